@@ -4,10 +4,154 @@ import os
 import glob
 import numpy as np
 import logging
+import itertools
+import threading
+import time
+
+from .instrumentation import span, cache_events
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+
+def box_iou(a, b):
+    """
+    Intersection over union of two (top, right, bottom, left) boxes.
+    """
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def box_center_shift(a, b):
+    """
+    Distance between the centers of two boxes, relative to the size of the first.
+    """
+    center_a = ((a[0] + a[2]) / 2, (a[1] + a[3]) / 2)
+    center_b = ((b[0] + b[2]) / 2, (b[1] + b[3]) / 2)
+    size = max(a[2] - a[0], a[1] - a[3], 1)
+    return np.hypot(center_a[0] - center_b[0], center_a[1] - center_b[1]) / size
+
+
+class FaceTrack:
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.name = "Unknown"
+        self.distance = None
+        self.last_seen = now
+        self.verified_at = None
+
+
+class FaceTracker:
+    """
+    Per-session face tracks, so an identity confirmed in one frame is reused
+    for the same face in the following frames instead of re-encoding it.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_center_shift=0.5, max_track_age=2.0,
+                 reverify_interval=5.0, confident_distance=0.45, session_ttl=300.0):
+        """
+        :param iou_threshold: Minimum box overlap for a face to continue a track.
+        :param max_center_shift: Maximum center movement, relative to box size, when boxes barely overlap.
+        :param max_track_age: Seconds a track survives without being seen before it is lost.
+        :param reverify_interval: Seconds after which a track's identity is encoded and matched again.
+        :param confident_distance: Gallery distance under which an identity is trusted for the whole track.
+        :param session_ttl: Seconds of inactivity after which a session's tracks are forgotten.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_center_shift = max_center_shift
+        self.max_track_age = max_track_age
+        self.reverify_interval = reverify_interval
+        self.confident_distance = confident_distance
+        self.session_ttl = session_ttl
+
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """
+        Forget every track, e.g. after the known faces changed.
+        """
+        with self._lock:
+            self._sessions.clear()
+
+    def assign(self, session_id, face_locations, now=None):
+        """
+        Match the faces of a new frame to the session's tracks, starting new tracks as needed.
+        :return: One FaceTrack per face location, in the same order.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # Drop idle sessions and lost tracks
+            for sid in [sid for sid, session in self._sessions.items() if now - session['last_seen'] > self.session_ttl]:
+                del self._sessions[sid]
+            session = self._sessions.setdefault(session_id, {'tracks': [], 'last_seen': now})
+            session['last_seen'] = now
+            tracks = [track for track in session['tracks'] if now - track.last_seen <= self.max_track_age]
+
+            # Greedy matching, best overlapping pairs first
+            candidates = []
+            for face_index, box in enumerate(face_locations):
+                for track_index, track in enumerate(tracks):
+                    iou = box_iou(track.box, box)
+                    if iou >= self.iou_threshold or box_center_shift(track.box, box) <= self.max_center_shift:
+                        candidates.append((iou, -box_center_shift(track.box, box), face_index, track_index))
+            candidates.sort(reverse=True)
+
+            assigned = [None] * len(face_locations)
+            used_tracks = set()
+            for _, _, face_index, track_index in candidates:
+                if assigned[face_index] is None and track_index not in used_tracks:
+                    assigned[face_index] = tracks[track_index]
+                    used_tracks.add(track_index)
+
+            for face_index, box in enumerate(face_locations):
+                if assigned[face_index] is None:
+                    track = FaceTrack(next(self._ids), box, now)
+                    tracks.append(track)
+                    assigned[face_index] = track
+                assigned[face_index].box = box
+                assigned[face_index].last_seen = now
+
+            session['tracks'] = tracks
+            return assigned
+
+    def needs_encoding(self, track, now=None):
+        """
+        Whether a track's identity must be (re)computed: new, unknown, uncertain or due for re-verification.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if track.verified_at is None or track.name == "Unknown":
+                return True
+            if track.distance is None or track.distance > self.confident_distance:
+                return True
+            return now - track.verified_at >= self.reverify_interval
+
+    def names(self, tracks):
+        """
+        Current names of the given tracks, read under the lock.
+        """
+        with self._lock:
+            return [track.name for track in tracks]
+
+    def confirm(self, track, name, distance, now=None):
+        """
+        Record the identity just computed for a track. Tracks are shared by
+        concurrent requests of the same session, so this goes through the lock.
+        """
+        with self._lock:
+            track.name = name
+            track.distance = distance
+            track.verified_at = time.monotonic() if now is None else now
+
+
 class SimpleFacerec:
     def __init__(self):
         self.known_face_encodings = []
@@ -16,6 +160,9 @@ class SimpleFacerec:
         # Resize frame for faster processing
         self.frame_resizing = 0.25
 
+        # Identity tracks of recent frames, per client session
+        self.tracker = FaceTracker()
+
     def load_encoding_images(self, images_path):
         """
         Load encoding images from the specified path.
@@ -53,39 +200,97 @@ class SimpleFacerec:
             self.known_face_encodings.append(encodings[0])
             self.known_face_names.append(cleaned_name)
 
+        # Identities of existing tracks may have changed with the new gallery
+        self.tracker.clear()
+
         print("Encoding images loaded")
 
+    def match_encoding(self, face_encoding):
+        """
+        Match a face encoding against the known faces.
+        :return: The best matching name ("Unknown" if none matches) and its distance.
+        """
+        if len(self.known_face_encodings) == 0:
+            return "Unknown", None
+
+        # Compare face encoding with known faces
+        matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
+
+        # Calculate face distance to find the best match
+        face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
+        best_match_index = np.argmin(face_distances)
+        if matches[best_match_index]:
+            return self.known_face_names[best_match_index], float(face_distances[best_match_index])
+        return "Unknown", float(face_distances[best_match_index])
+
+    def _locate_faces(self, frame):
+        """
+        Find the faces of a frame on a downscaled RGB copy of it.
+        :param frame: The BGR image frame from which to detect faces.
+        :return: The downscaled RGB frame and the face locations on it.
+        """
+        with span('face_preprocess'):
+            # Resize frame for faster processing
+            small_frame = cv2.resize(frame, (0, 0), fx=self.frame_resizing, fy=self.frame_resizing)
+
+            # Convert the image from BGR color to RGB color
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+        with span('face_locate'):
+            face_locations = face_recognition.face_locations(rgb_small_frame)
+        return rgb_small_frame, face_locations
+
     def detect_known_faces(self, frame):
         """
         Detect faces in the frame and return their locations and names.
         :param frame: The image frame from which to detect faces.
         :return: Face locations and face names.
         """
-        # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=self.frame_resizing, fy=self.frame_resizing)
-
-        # Convert the image from BGR color to RGB color
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-
         # Detect faces and face encodings in the current frame
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-
-        face_names = []
-        for face_encoding in face_encodings:
-            # Compare face encoding with known faces
-            matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-            name = "Unknown"
-
-            # Calculate face distance to find the best match
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                if matches[best_match_index]:
-                    name = self.known_face_names[best_match_index]
-            face_names.append(name)
+        rgb_small_frame, face_locations = self._locate_faces(frame)
+        with span('face_encode'):
+            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+
+        with span('face_match'):
+            face_names = [self.match_encoding(face_encoding)[0] for face_encoding in face_encodings]
 
         # Adjust face locations according to resizing
         face_locations = np.array(face_locations)
         face_locations = face_locations / self.frame_resizing
         return face_locations.astype(int), face_names
+
+    def detect_known_faces_tracked(self, frame, session_id):
+        """
+        Like detect_known_faces, but reuses identities confirmed in earlier frames of the
+        same session, so only new or uncertain faces are encoded.
+        :param frame: The image frame from which to detect faces.
+        :param session_id: Identifier of the client session the frame belongs to.
+        :return: Face locations, face names and stats on how many faces were encoded or cached.
+        """
+        rgb_small_frame, face_locations = self._locate_faces(frame)
+
+        now = time.monotonic()
+        tracks = self.tracker.assign(session_id, face_locations, now)
+
+        # Encode only the faces whose track has no trusted identity yet
+        to_encode = [i for i, track in enumerate(tracks) if self.tracker.needs_encoding(track, now)]
+        if to_encode:
+            with span('face_encode'):
+                face_encodings = face_recognition.face_encodings(rgb_small_frame, [face_locations[i] for i in to_encode])
+            with span('face_match'):
+                for i, face_encoding in zip(to_encode, face_encodings):
+                    name, distance = self.match_encoding(face_encoding)
+                    self.tracker.confirm(tracks[i], name, distance, now)
+
+        face_names = self.tracker.names(tracks)
+        stats = {
+            "faces": len(face_locations),
+            "encoded": len(to_encode),
+            "from_track_cache": len(face_locations) - len(to_encode),
+        }
+        cache_events.inc(stats["from_track_cache"], cache='face_track', result='hit')
+        cache_events.inc(stats["encoded"], cache='face_track', result='miss')
+
+        face_locations = np.array(face_locations)
+        face_locations = face_locations / self.frame_resizing
+        return face_locations.astype(int), face_names, stats
@@ -0,0 +1,273 @@
+import os
+import time
+import random
+import logging
+import threading
+import cProfile
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(key, {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0})
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Register a callable run before every render, to refresh gauges from live state.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+request_latency = registry.histogram('vision_request_duration_seconds', 'End-to-end request latency per endpoint.')
+requests_total = registry.counter('vision_requests_total', 'Requests served per endpoint and status code.')
+stage_latency = registry.histogram('vision_stage_duration_seconds', 'Latency of each stage of a request.')
+model_load_seconds = registry.gauge('vision_model_load_seconds', 'Time taken to load each model at startup.')
+cache_events = registry.counter('vision_cache_events_total', 'Cache lookups per cache and result (hit or miss).')
+
+# Refreshed from the scheduler on every scrape, except queue_outcomes counted as they happen (see api/scheduler.py)
+scheduler_queue_depth = registry.gauge('vision_scheduler_queue_depth', 'Inferences waiting for a thread budget.')
+scheduler_threads_in_use = registry.gauge('vision_scheduler_threads_in_use', 'Threads held by running inferences.')
+model_in_flight = registry.gauge('vision_model_in_flight', 'Running inferences per model.')
+model_utilization = registry.gauge('vision_model_utilization',
+                                   'Share of the inference thread budget each model held since startup.')
+queue_outcomes = registry.counter('vision_scheduler_queue_outcomes_total',
+                                  'Queued inferences per priority class and outcome.')
+
+# Spans of the request currently handled by this thread
+_local = threading.local()
+
+
+def start_request(endpoint):
+    _local.endpoint = endpoint
+    _local.spans = []
+
+
+def finish_request():
+    """
+    Return the spans recorded for the current request and reset the thread's state.
+    """
+    spans = getattr(_local, 'spans', None) or []
+    _local.endpoint = None
+    _local.spans = None
+    return spans
+
+
+def record_span(name, seconds):
+    """
+    Record an already measured stage of the current request.
+    """
+    endpoint = getattr(_local, 'endpoint', None) or 'none'
+    stage_latency.observe(seconds, endpoint=endpoint, stage=name)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name):
+    """
+    Time a stage of the current request, e.g. `with span('inference'): ...`.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started_at)
+
+
+@contextmanager
+def timed_model_load(model):
+    """
+    Time the loading of a model at startup.
+    """
+    started_at = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started_at
+    model_load_seconds.set(elapsed, model=model)
+    logger.info(f"Loaded {model} model in {elapsed:.2f}s")
+
+
+def server_timing_header(spans):
+    """
+    Format spans as a Server-Timing header value, summing repeated stages.
+    """
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+# cProfile can only profile one request at a time
+_profile_lock = threading.Lock()
+
+
+class InstrumentationMiddleware:
+    """
+    Times every request, adds the Server-Timing header and optionally captures a
+    cProfile dump of a sample of slow requests (see PROFILE_* settings).
+    """
+
+    def __init__(self, get_response):
+        from django.conf import settings
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        self.slow_seconds = getattr(settings, 'PROFILE_SLOW_REQUEST_SECONDS', 2.0)
+        self.profile_dir = getattr(settings, 'PROFILE_DIR', os.path.join(settings.MEDIA_ROOT, 'profiles'))
+
+    def __call__(self, request):
+        from django.urls import Resolver404, resolve
+        try:
+            endpoint = resolve(request.path_info).url_name or 'unknown'
+        except Resolver404:
+            endpoint = 'unmatched'
+        start_request(endpoint)
+
+        profiler = None
+        if self.sample_rate > 0 and random.random() < self.sample_rate and _profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            if profiler is not None:
+                profiler.disable()
+                _profile_lock.release()
+            spans = finish_request()
+
+        request_latency.observe(elapsed, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, status=response.status_code)
+        spans.append(('total', elapsed))
+        response['Server-Timing'] = server_timing_header(spans)
+
+        if profiler is not None and elapsed >= self.slow_seconds:
+            self._dump_profile(profiler, endpoint, elapsed)
+        return response
+
+    def _dump_profile(self, profiler, endpoint, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{endpoint}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"Slow request to {endpoint} took {elapsed:.2f}s, profile saved at {path}")
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from .scheduler import RequestAborted
+
+
+# Preprocess video for MoViNet model
+def preprocess_video(video_path, frame_size=(224, 224), num_frames=100, ticket=None):
+    frames = []
+    cap = cv2.VideoCapture(video_path)
+    frame_count = 0
+
+    while cap.isOpened() and frame_count < num_frames:
+        # Stop decoding as soon as the request is no longer wanted
+        if ticket is not None:
+            try:
+                ticket.check()
+            except RequestAborted:
+                cap.release()
+                raise
+        ret, frame = cap.read()
+        if not ret:
+            break
+        resized_frame = cv2.resize(frame, frame_size)
+        rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
+        normalized_frame = rgb_frame / 255.0
+        frames.append(normalized_frame)
+        frame_count += 1
+
+    cap.release()
+
+    # Convert list of frames to a NumPy array
+    video_tensor = np.stack(frames, axis=0)
+    video_tensor = np.expand_dims(video_tensor, axis=0)  # Add batch dimension
+    return tf.convert_to_tensor(video_tensor, dtype=tf.float32)
+
+
+# Keep YOLO detections above the confidence threshold, as a list of records
+def filter_detections(detections, confidence_threshold):
+    """
+    :param detections: YOLO detections as a pandas DataFrame (results.pandas().xyxy[0]).
+    :param confidence_threshold: Minimum confidence of a detection to keep.
+    :return: The kept detections as a list of dicts.
+    """
+    # Filter in pandas first so only the kept rows are converted to dicts
+    return detections[detections['confidence'] >= confidence_threshold].to_dict(orient="records")
@@ -0,0 +1,469 @@
+import os
+import ssl
+import math
+import time
+import heapq
+import socket
+import logging
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from . import instrumentation
+from .instrumentation import record_span
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Default thread budgets for every model hosted by this process.
+# Models of the same framework share one thread pool, sized to the largest
+# intra_op_threads among them; an inference takes that many CPU "slots" from
+# the shared budget while it runs.
+DEFAULT_MODEL_BUDGETS = {
+    'currency': {'framework': 'tensorflow', 'intra_op_threads': 2, 'inter_op_threads': 1},
+    'activity': {'framework': 'tensorflow', 'intra_op_threads': 4, 'inter_op_threads': 1},
+    'yolo': {'framework': 'torch', 'intra_op_threads': 2, 'inter_op_threads': 1},
+    'face': {'framework': 'dlib', 'intra_op_threads': 1, 'inter_op_threads': 1},
+}
+
+
+
+def model_budgets(overrides=None):
+    """
+    DEFAULT_MODEL_BUDGETS with the given per-model overrides applied,
+    e.g. {'activity': {'intra_op_threads': 2}}. New models must give a full budget.
+    """
+    budgets = {name: dict(budget) for name, budget in DEFAULT_MODEL_BUDGETS.items()}
+    for name, budget in (overrides or {}).items():
+        budgets.setdefault(name, {}).update(budget)
+    return budgets
+
+
+# Priority classes, lower value is admitted first
+DEFAULT_PRIORITY_CLASSES = {'interactive': 0, 'normal': 1, 'batch': 2}
+
+# Priority class of every endpoint, unlisted endpoints run as 'normal'
+DEFAULT_ENDPOINT_PRIORITIES = {
+    'detect_currency': 'interactive',
+    'recognize_face': 'interactive',
+    'object_detection': 'normal',
+    'add_face': 'normal',
+    'read_text': 'normal',
+    'activity_recognition': 'batch',
+    'describe_image': 'batch',
+}
+
+# Header carrying how many milliseconds the client is still willing to wait
+DEADLINE_HEADER = 'HTTP_X_REQUEST_DEADLINE_MS'
+
+# How often queued requests re-check their deadline and client connection
+POLL_INTERVAL = 0.05
+
+
+class RequestAborted(Exception):
+    """
+    The request should stop: its deadline passed or its client went away.
+    """
+    pass
+
+
+class DeadlineExceeded(RequestAborted):
+    pass
+
+
+class RequestCancelled(RequestAborted):
+    pass
+
+
+def client_disconnected(request):
+    """
+    Check whether the client behind a request has closed its connection.
+    Only possible when the server exposes the raw socket (gunicorn does), otherwise always False:
+    under `manage.py runserver` a disconnected client is never noticed and its work is not cancelled.
+    """
+    sock = request.META.get('gunicorn.socket')
+    # TLS sockets refuse recv flags, and peeking would only see encrypted bytes anyway
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        return False
+    try:
+        # A readable socket returning no data means the peer closed it
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, ValueError):
+        return False
+    except OSError:
+        return True
+
+
+class InferenceTicket:
+    """
+    Scheduling information of one request: its priority class, deadline and
+    a way to find out whether the client is still waiting.
+    """
+
+    def __init__(self, endpoint, priority_class='normal', priority=1, deadline=None, is_disconnected=None):
+        """
+        :param endpoint: Name of the endpoint serving the request.
+        :param priority_class: Name of the priority class.
+        :param priority: Numeric priority of the class, lower is served first.
+        :param deadline: time.monotonic() value after which the result is useless, or None.
+        :param is_disconnected: Callable returning True once the client has gone away.
+        """
+        self.endpoint = endpoint
+        self.priority_class = priority_class
+        self.priority = priority
+        self.deadline = deadline
+        self.is_disconnected = is_disconnected
+
+    def remaining(self):
+        """
+        Seconds left until the deadline, or None without a deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def timeout(self):
+        """
+        Timeout for a blocking call (e.g. requests.post): the time left, or None without a deadline.
+        Raises DeadlineExceeded when no time is left, a zero timeout is not a valid timeout.
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded for {self.endpoint}")
+        return remaining
+
+    def check(self):
+        """
+        Raise if the request should not continue. Call between the stages of a request.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded(f"Deadline exceeded for {self.endpoint}")
+        if self.is_disconnected is not None and self.is_disconnected():
+            raise RequestCancelled(f"Client disconnected from {self.endpoint}")
+
+
+class ModelScheduler:
+    """
+    Admit inferences of co-resident TensorFlow, PyTorch and dlib models so that
+    the threads they use together never exceed the CPU budget of the process.
+    """
+
+    def __init__(self, budgets=None, total_threads=None, cores=None):
+        """
+        :param budgets: Mapping of model name to its thread budget (see DEFAULT_MODEL_BUDGETS).
+        :param total_threads: Total threads inferences may use at once. Defaults to the number of
+            cores the process may run on: the given cores, else its affinity mask.
+        :param cores: Optional set of CPU cores the whole process is pinned to (see pin_threads).
+        """
+        self.budgets = {name: dict(budget) for name, budget in (budgets or DEFAULT_MODEL_BUDGETS).items()}
+        self.cores = set(cores) if cores else None
+        self.total_threads = total_threads or self._available_cores()
+
+        # One intra-op/inter-op pool per framework, sized for its most demanding model
+        self.pool_sizes = {}
+        for budget in self.budgets.values():
+            pool = self.pool_sizes.setdefault(budget['framework'], {'intra': 1, 'inter': 1})
+            pool['intra'] = max(pool['intra'], budget['intra_op_threads'])
+            pool['inter'] = max(pool['inter'], budget['inter_op_threads'])
+
+        self._cond = threading.Condition()
+        self._threads_in_use = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._class_stats = {}
+        self._started_at = time.monotonic()
+        self._stats = {
+            name: {'in_flight': 0, 'completed': 0, 'busy_seconds': 0.0, 'wait_seconds': 0.0}
+            for name in self.budgets
+        }
+
+    def _available_cores(self):
+        # cpu_count() ignores pinning and container cpusets, the affinity mask does not
+        if self.cores:
+            return len(self.cores)
+        if hasattr(os, 'sched_getaffinity'):
+            return len(os.sched_getaffinity(0)) or 1
+        return os.cpu_count() or 1
+
+    def _cost(self, model):
+        # An inference can use every thread of its framework's pool, whatever its own budget says.
+        # A single model can never ask for more than the whole budget.
+        return min(self.pool_sizes[self.budgets[model]['framework']]['intra'], self.total_threads)
+
+    def configure_frameworks(self):
+        """
+        Size the TensorFlow, PyTorch and BLAS thread pools to the configured budgets.
+        Must run before the models are loaded, the pools are fixed once created.
+        """
+        per_framework = self.pool_sizes
+
+        if 'tensorflow' in per_framework:
+            import tensorflow as tf
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(per_framework['tensorflow']['intra'])
+                tf.config.threading.set_inter_op_parallelism_threads(per_framework['tensorflow']['inter'])
+            except RuntimeError as e:
+                logger.warning(f"TensorFlow thread pools already initialized: {str(e)}")
+
+        if 'torch' in per_framework:
+            import torch
+            torch.set_num_threads(per_framework['torch']['intra'])
+            try:
+                torch.set_num_interop_threads(per_framework['torch']['inter'])
+            except RuntimeError as e:
+                logger.warning(f"PyTorch inter-op pool already initialized: {str(e)}")
+
+        # dlib goes through BLAS/OpenMP, whose pools are sized from the environment
+        # (see settings.py, which exports these before numpy is imported)
+        if 'dlib' in per_framework:
+            os.environ.setdefault('OMP_NUM_THREADS', str(per_framework['dlib']['intra']))
+
+        # Threads created from now on by this thread inherit its core set
+        self.pin_threads()
+
+        logger.info(f"Framework thread pools configured: {per_framework}, cores: {sorted(self.cores or []) or 'all'}")
+
+    def pin_threads(self):
+        """
+        Pin every thread of the process to the configured cores.
+        sched_setaffinity only moves a single thread on Linux, so this walks /proc/self/task.
+        Call it again once the models are loaded, to catch the framework pool threads.
+        """
+        if not self.cores or not hasattr(os, 'sched_setaffinity'):
+            return
+        try:
+            thread_ids = [int(tid) for tid in os.listdir('/proc/self/task')]
+        except OSError:
+            thread_ids = [0]
+        for tid in thread_ids:
+            try:
+                os.sched_setaffinity(tid, self.cores)
+            except OSError:
+                # The thread exited in the meantime
+                pass
+
+    def _class_stats_for(self, priority_class):
+        return self._class_stats.setdefault(priority_class, {
+            'admitted': 0, 'expired': 0, 'cancelled': 0,
+            'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+            'recent_waits': deque(maxlen=1000),
+        })
+
+    def _count_dropped(self, priority_class, error):
+        # Called with self._cond held
+        outcome = 'expired' if isinstance(error, DeadlineExceeded) else 'cancelled'
+        self._class_stats_for(priority_class)[outcome] += 1
+        instrumentation.queue_outcomes.inc(priority_class=priority_class, outcome=outcome)
+
+    def acquire(self, model, ticket=None):
+        """
+        Block until the model's thread budget fits in the remaining total budget.
+        Waiting requests are admitted in priority order, then arrival order.
+        Raises DeadlineExceeded or RequestCancelled if the ticket expires while queued
+        or is found expired once admitted; the request then holds no threads.
+        """
+        cost = self._cost(model)
+        priority = ticket.priority if ticket else DEFAULT_PRIORITY_CLASSES['normal']
+        priority_class = ticket.priority_class if ticket else 'normal'
+        entry = [priority, next(self._sequence)]
+        queued_at = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+        try:
+            while True:
+                with self._cond:
+                    if self._waiting[0] is entry and self._threads_in_use + cost <= self.total_threads:
+                        heapq.heappop(self._waiting)
+                        self._threads_in_use += cost
+                        # The next request in line may fit in what is left
+                        self._cond.notify_all()
+                        break
+                    timeout = POLL_INTERVAL
+                    if ticket is not None and ticket.deadline is not None:
+                        timeout = min(timeout, ticket.remaining())
+                    self._cond.wait(timeout=timeout)
+                # Outside the lock: peeking at the client socket is a syscall
+                if ticket is not None:
+                    ticket.check()
+        except (DeadlineExceeded, RequestCancelled) as e:
+            # Drop the request from the queue and let the next one in line move up
+            with self._cond:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._count_dropped(priority_class, e)
+                self._cond.notify_all()
+            logger.info(f"Dropped queued {model} inference: {str(e)}")
+            raise
+
+        # The deadline may have passed, or the client left, since the last check
+        try:
+            if ticket is not None:
+                ticket.check()
+        except (DeadlineExceeded, RequestCancelled) as e:
+            with self._cond:
+                self._threads_in_use -= cost
+                self._count_dropped(priority_class, e)
+                self._cond.notify_all()
+            logger.info(f"Dropped admitted {model} inference: {str(e)}")
+            raise
+
+        waited = time.monotonic() - queued_at
+        with self._cond:
+            self._stats[model]['in_flight'] += 1
+            self._stats[model]['wait_seconds'] += waited
+            stats = self._class_stats_for(priority_class)
+            stats['admitted'] += 1
+            stats['total_wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+            stats['recent_waits'].append(waited)
+        instrumentation.queue_outcomes.inc(priority_class=priority_class, outcome='admitted')
+        record_span('queue', waited)
+
+    def release(self, model, busy_seconds):
+        cost = self._cost(model)
+        with self._cond:
+            self._threads_in_use -= cost
+            stats = self._stats[model]
+            stats['in_flight'] -= 1
+            stats['completed'] += 1
+            stats['busy_seconds'] += busy_seconds
+            self._cond.notify_all()
+
+    @contextmanager
+    def run(self, model, ticket=None):
+        """
+        Context manager wrapping a single inference of the given model.
+        :param ticket: Optional InferenceTicket of the request, see acquire.
+        """
+        self.acquire(model, ticket)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(model, time.monotonic() - started_at)
+
+    def stats(self):
+        """
+        Per-model utilization snapshot.
+        """
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        with self._cond:
+            models = {}
+            for name, stats in self._stats.items():
+                completed = stats['completed']
+                models[name] = {
+                    'thread_budget': self._cost(name),
+                    'in_flight': stats['in_flight'],
+                    'completed': completed,
+                    # Share of the whole thread budget this model held since startup, between 0 and 1
+                    'utilization': stats['busy_seconds'] * self._cost(name) / (uptime * self.total_threads),
+                    'avg_busy_seconds': stats['busy_seconds'] / completed if completed else 0.0,
+                    'avg_wait_seconds': stats['wait_seconds'] / completed if completed else 0.0,
+                }
+            classes = {}
+            for name, stats in self._class_stats.items():
+                admitted = stats['admitted']
+                recent = sorted(stats['recent_waits'])
+                classes[name] = {
+                    'admitted': admitted,
+                    'expired': stats['expired'],
+                    'cancelled': stats['cancelled'],
+                    'avg_wait_seconds': stats['total_wait_seconds'] / admitted if admitted else 0.0,
+                    'p95_wait_seconds': recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+                    'max_wait_seconds': stats['max_wait_seconds'],
+                }
+            return {
+                'total_threads': self.total_threads,
+                'threads_in_use': self._threads_in_use,
+                'queued': len(self._waiting),
+                'models': models,
+                'priority_classes': classes,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Return the process-wide scheduler, with settings.MODEL_THREAD_BUDGETS applied over the defaults.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from django.conf import settings
+            _scheduler = ModelScheduler(
+                budgets=model_budgets(getattr(settings, 'MODEL_THREAD_BUDGETS', None)),
+                total_threads=getattr(settings, 'INFERENCE_THREAD_BUDGET', None),
+                cores=getattr(settings, 'INFERENCE_CORES', None),
+            )
+            instrumentation.registry.add_collector(lambda: collect_metrics(_scheduler))
+        return _scheduler
+
+
+def collect_metrics(scheduler):
+    """
+    Refresh the scheduler gauges of api.instrumentation, run right before every scrape.
+    """
+    stats = scheduler.stats()
+    instrumentation.scheduler_queue_depth.set(stats['queued'])
+    instrumentation.scheduler_threads_in_use.set(stats['threads_in_use'])
+    for model, model_stats in stats['models'].items():
+        instrumentation.model_in_flight.set(model_stats['in_flight'], model=model)
+        instrumentation.model_utilization.set(model_stats['utilization'], model=model)
+
+
+def make_ticket(request, endpoint):
+    """
+    Build the InferenceTicket of a request from its endpoint and deadline header.
+    """
+    from django.conf import settings
+    classes = {**DEFAULT_PRIORITY_CLASSES, **getattr(settings, 'REQUEST_PRIORITY_CLASSES', {})}
+    endpoints = {**DEFAULT_ENDPOINT_PRIORITIES, **getattr(settings, 'ENDPOINT_PRIORITIES', {})}
+    priority_class = endpoints.get(endpoint, 'normal')
+
+    deadline = None
+    header = request.META.get(DEADLINE_HEADER)
+    if header:
+        try:
+            budget_ms = float(header)
+        except ValueError:
+            budget_ms = None
+        # nan or inf would make a deadline that never expires
+        if budget_ms is None or not math.isfinite(budget_ms):
+            logger.warning(f"Ignoring invalid deadline header: {header}")
+        else:
+            deadline = time.monotonic() + max(budget_ms, 0.0) / 1000.0
+
+    return InferenceTicket(
+        endpoint,
+        priority_class=priority_class,
+        priority=classes.get(priority_class, classes.get('normal', 1)),
+        deadline=deadline,
+        is_disconnected=lambda: client_disconnected(request),
+    )
+
+
+def scheduled_endpoint(endpoint):
+    """
+    Decorator attaching an InferenceTicket to request.ticket and turning expired
+    or abandoned requests into 504 / 499 responses.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            from django.http import JsonResponse
+            request.ticket = make_ticket(request, endpoint)
+            try:
+                request.ticket.check()
+                return view(request, *args, **kwargs)
+            except DeadlineExceeded:
+                return JsonResponse({"error": "Deadline exceeded"}, status=504)
+            except RequestCancelled:
+                # Nobody is listening any more, 499 mirrors nginx's "client closed request"
+                return JsonResponse({"error": "Client closed request"}, status=499)
+        return wrapper
+    return decorator
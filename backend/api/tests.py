@@ -1,3 +1,362 @@
-from django.test import TestCase
+import ssl
+import threading
+import time
 
-# Create your tests here.
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import path
+
+from . import instrumentation
+
+from .scheduler import (ModelScheduler, InferenceTicket, DeadlineExceeded, RequestCancelled,
+                        client_disconnected, make_ticket as make_request_ticket, scheduled_endpoint)
+
+
+def wait_until(condition, timeout=2.0):
+    # Poll until a condition driven by other threads holds
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached in time")
+        time.sleep(0.005)
+
+
+class ModelSchedulerTests(SimpleTestCase):
+    def test_models_of_a_framework_are_charged_its_pool_size(self):
+        scheduler = ModelScheduler(total_threads=8)
+        # currency asks for 2 threads but shares TensorFlow's pool of 4 with activity
+        self.assertEqual(scheduler._cost('currency'), 4)
+        self.assertEqual(scheduler._cost('activity'), 4)
+        self.assertEqual(scheduler._cost('yolo'), 2)
+
+    def test_cost_is_capped_at_the_total_budget(self):
+        scheduler = ModelScheduler(total_threads=3)
+        self.assertEqual(scheduler._cost('activity'), 3)
+
+    def test_budget_defaults_to_the_pinned_cores(self):
+        scheduler = ModelScheduler(cores={0, 1, 2})
+        self.assertEqual(scheduler.total_threads, 3)
+
+    def test_admission_waits_for_release(self):
+        scheduler = ModelScheduler(total_threads=4)
+        scheduler.acquire('activity')
+        admitted = threading.Event()
+
+        def second():
+            with scheduler.run('yolo'):
+                admitted.set()
+
+        worker = threading.Thread(target=second)
+        worker.start()
+        wait_until(lambda: scheduler.stats()['queued'] == 1)
+        self.assertFalse(admitted.is_set())
+
+        scheduler.release('activity', 0.0)
+        worker.join(timeout=2.0)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(scheduler.stats()['threads_in_use'], 0)
+
+    def test_utilization_stays_within_one(self):
+        scheduler = ModelScheduler(total_threads=4)
+        for _ in range(2):
+            scheduler.acquire('yolo')
+        time.sleep(0.05)
+        for _ in range(2):
+            scheduler.release('yolo', 0.05)
+        utilization = scheduler.stats()['models']['yolo']['utilization']
+        self.assertGreater(utilization, 0.0)
+        self.assertLessEqual(utilization, 1.0)
+
+
+def make_ticket(priority_class, priority, deadline=None, is_disconnected=None):
+    return InferenceTicket('test', priority_class=priority_class, priority=priority,
+                           deadline=deadline, is_disconnected=is_disconnected)
+
+
+class PrioritySchedulingTests(SimpleTestCase):
+    def test_higher_priority_is_admitted_first(self):
+        scheduler = ModelScheduler(total_threads=2)
+        scheduler.acquire('yolo')
+        order = []
+
+        def request(name, priority):
+            with scheduler.run('yolo', make_ticket(name, priority)):
+                order.append(name)
+
+        batch = threading.Thread(target=request, args=('batch', 2))
+        batch.start()
+        wait_until(lambda: scheduler.stats()['queued'] == 1)
+        interactive = threading.Thread(target=request, args=('interactive', 0))
+        interactive.start()
+        wait_until(lambda: scheduler.stats()['queued'] == 2)
+
+        scheduler.release('yolo', 0.0)
+        batch.join(timeout=2.0)
+        interactive.join(timeout=2.0)
+        self.assertEqual(order, ['interactive', 'batch'])
+
+    def test_expired_request_is_dropped_while_queued(self):
+        scheduler = ModelScheduler(total_threads=2)
+        scheduler.acquire('yolo')
+        ticket = make_ticket('normal', 1, deadline=time.monotonic() + 0.05)
+
+        with self.assertRaises(DeadlineExceeded):
+            scheduler.acquire('yolo', ticket)
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['priority_classes']['normal']['expired'], 1)
+
+        # The dropped request must not hold back the next one
+        scheduler.release('yolo', 0.0)
+        scheduler.acquire('yolo')
+        self.assertEqual(scheduler.stats()['threads_in_use'], 2)
+
+    def test_request_expired_when_admitted_holds_no_threads(self):
+        scheduler = ModelScheduler(total_threads=2)
+        ticket = make_ticket('normal', 1, deadline=time.monotonic() - 1)
+
+        with self.assertRaises(DeadlineExceeded):
+            with scheduler.run('yolo', ticket):
+                self.fail("An expired request must not run")
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['threads_in_use'], 0)
+        self.assertEqual(stats['priority_classes']['normal']['admitted'], 0)
+        self.assertEqual(stats['priority_classes']['normal']['expired'], 1)
+
+    def test_disconnected_request_is_cancelled_while_queued(self):
+        scheduler = ModelScheduler(total_threads=2)
+        scheduler.acquire('yolo')
+        ticket = make_ticket('normal', 1, is_disconnected=lambda: True)
+
+        with self.assertRaises(RequestCancelled):
+            scheduler.acquire('yolo', ticket)
+        self.assertEqual(scheduler.stats()['priority_classes']['normal']['cancelled'], 1)
+
+
+class InferenceTicketTests(SimpleTestCase):
+    def test_without_deadline(self):
+        ticket = make_ticket('normal', 1)
+        self.assertIsNone(ticket.remaining())
+        self.assertIsNone(ticket.timeout())
+        ticket.check()
+
+    def test_spent_deadline(self):
+        ticket = make_ticket('normal', 1, deadline=time.monotonic() - 1)
+        self.assertEqual(ticket.remaining(), 0.0)
+        with self.assertRaises(DeadlineExceeded):
+            ticket.check()
+        with self.assertRaises(DeadlineExceeded):
+            ticket.timeout()
+
+    def test_remaining_time_is_the_timeout(self):
+        ticket = make_ticket('normal', 1, deadline=time.monotonic() + 10)
+        self.assertGreater(ticket.timeout(), 9)
+
+
+class DeadlineHeaderTests(SimpleTestCase):
+    def ticket(self, header=None):
+        extra = {'HTTP_X_REQUEST_DEADLINE_MS': header} if header is not None else {}
+        return make_request_ticket(RequestFactory().post('/api/detect_currency/', **extra), 'detect_currency')
+
+    def test_priority_class_of_the_endpoint(self):
+        ticket = self.ticket()
+        self.assertEqual(ticket.priority_class, 'interactive')
+        self.assertEqual(ticket.priority, 0)
+        self.assertIsNone(ticket.deadline)
+
+    def test_budget_sets_the_deadline(self):
+        remaining = self.ticket('1500').remaining()
+        self.assertGreater(remaining, 1.0)
+        self.assertLessEqual(remaining, 1.5)
+
+    def test_invalid_header_is_ignored(self):
+        for header in ('soon', '', 'nan', 'inf', '-inf'):
+            self.assertIsNone(self.ticket(header).deadline, header)
+
+    def test_zero_or_negative_budget_is_already_expired(self):
+        for header in ('0', '-250'):
+            with self.assertRaises(DeadlineExceeded):
+                self.ticket(header).check()
+
+
+class FakeSocket:
+    """
+    Stands in for the client socket gunicorn exposes as request.META['gunicorn.socket'].
+    """
+
+    def __init__(self, data=b'', error=None):
+        self.data = data
+        self.error = error
+
+    def recv(self, size, flags=0):
+        if self.error is not None:
+            raise self.error
+        return self.data[:size]
+
+
+class FakeTLSSocket(ssl.SSLSocket):
+    def __init__(self):
+        # ssl.SSLSocket cannot be instantiated directly, and no connection is needed here
+        pass
+
+    def recv(self, size, flags=0):
+        raise AssertionError("TLS sockets must not be peeked")
+
+
+class ClientDisconnectedTests(SimpleTestCase):
+    def request(self, sock=None):
+        request = RequestFactory().post('/api/detect_currency/')
+        if sock is not None:
+            request.META['gunicorn.socket'] = sock
+        return request
+
+    def test_without_socket(self):
+        # e.g. manage.py runserver, which does not expose the socket
+        self.assertFalse(client_disconnected(self.request()))
+
+    def test_tls_socket_is_not_peeked(self):
+        self.assertFalse(client_disconnected(self.request(FakeTLSSocket())))
+
+    def test_peer_closed(self):
+        self.assertTrue(client_disconnected(self.request(FakeSocket(b''))))
+
+    def test_pending_data_or_nothing_to_read(self):
+        self.assertFalse(client_disconnected(self.request(FakeSocket(b'GET'))))
+        self.assertFalse(client_disconnected(self.request(FakeSocket(error=BlockingIOError()))))
+
+    def test_reset_connection(self):
+        self.assertTrue(client_disconnected(self.request(FakeSocket(error=ConnectionResetError()))))
+
+
+class ScheduledEndpointTests(SimpleTestCase):
+    def call(self, view, header=None, sock=None):
+        extra = {'HTTP_X_REQUEST_DEADLINE_MS': header} if header is not None else {}
+        request = RequestFactory().post('/api/detect_currency/', **extra)
+        if sock is not None:
+            request.META['gunicorn.socket'] = sock
+        return scheduled_endpoint('detect_currency')(view)(request)
+
+    def test_view_gets_the_ticket(self):
+        response = self.call(lambda request: request.ticket)
+        self.assertEqual(response.endpoint, 'detect_currency')
+
+    def test_expired_deadline_is_a_504(self):
+        def view(request):
+            raise DeadlineExceeded("too late")
+        self.assertEqual(self.call(view).status_code, 504)
+
+    def test_spent_budget_skips_the_view(self):
+        def view(request):
+            raise AssertionError("The view must not run")
+        self.assertEqual(self.call(view, header='0').status_code, 504)
+
+    def test_disconnected_client_is_a_499(self):
+        def view(request):
+            raise AssertionError("The view must not run")
+        self.assertEqual(self.call(view, sock=FakeSocket(b'')).status_code, 499)
+
+    def test_cancelled_inference_is_a_499(self):
+        def view(request):
+            raise RequestCancelled("gone")
+        self.assertEqual(self.call(view).status_code, 499)
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = instrumentation.Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value, endpoint='scan')
+        self.assertEqual(histogram.render()[2:], [
+            'latency_seconds_bucket{endpoint="scan",le="0.1"} 1',
+            'latency_seconds_bucket{endpoint="scan",le="1.0"} 3',
+            'latency_seconds_bucket{endpoint="scan",le="+Inf"} 4',
+            'latency_seconds_sum{endpoint="scan"} 4.25',
+            'latency_seconds_count{endpoint="scan"} 4',
+        ])
+
+    def test_label_values_are_escaped(self):
+        counter = instrumentation.Counter('events_total', 'Events.')
+        counter.inc(name='a "b"\\c\nd')
+        self.assertEqual(counter.render()[2], 'events_total{name="a \\"b\\"\\\\c\\nd"} 1')
+
+    def test_server_timing_sums_repeated_stages(self):
+        header = instrumentation.server_timing_header([('inference', 0.01), ('decode', 0.002), ('inference', 0.02)])
+        self.assertEqual(header, 'inference;dur=30.0, decode;dur=2.0')
+
+
+def probe(request):
+    with instrumentation.span('inference'):
+        pass
+    return HttpResponse(b'ok')
+
+
+urlpatterns = [path('probe/', probe, name='probe')]
+
+
+@override_settings(ROOT_URLCONF=__name__, PROFILE_SAMPLE_RATE=0.0)
+class InstrumentationMiddlewareTests(SimpleTestCase):
+    def test_server_timing_header(self):
+        middleware = instrumentation.InstrumentationMiddleware(probe)
+        response = middleware(RequestFactory().get('/probe/'))
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['inference', 'total'])
+
+
+class FaceTrackerTests(SimpleTestCase):
+    def setUp(self):
+        from .facerec import FaceTracker
+        self.tracker = FaceTracker(iou_threshold=0.3, max_center_shift=0.5, max_track_age=2.0,
+                                   reverify_interval=5.0, confident_distance=0.45)
+
+    def test_overlapping_box_continues_the_track(self):
+        first, = self.tracker.assign('s', [(10, 60, 60, 10)], now=0.0)
+        second, = self.tracker.assign('s', [(12, 62, 62, 12)], now=0.1)
+        self.assertIs(first, second)
+        self.assertEqual(second.box, (12, 62, 62, 12))
+
+    def test_small_center_shift_continues_the_track(self):
+        # Overlap alone is never enough here, only the center shift (0.4 of the box size) can match
+        self.tracker.iou_threshold = 1.1
+        first, = self.tracker.assign('s', [(10, 20, 20, 10)], now=0.0)
+        second, = self.tracker.assign('s', [(10, 24, 20, 14)], now=0.1)
+        self.assertIs(first, second)
+
+    def test_distant_box_starts_a_new_track(self):
+        first, = self.tracker.assign('s', [(10, 60, 60, 10)], now=0.0)
+        second, = self.tracker.assign('s', [(200, 260, 260, 200)], now=0.1)
+        self.assertIsNot(first, second)
+
+    def test_each_face_gets_its_own_track(self):
+        left, right = self.tracker.assign('s', [(10, 60, 60, 10), (10, 260, 60, 210)], now=0.0)
+        again_right, again_left = self.tracker.assign('s', [(10, 262, 60, 212), (10, 62, 60, 12)], now=0.1)
+        self.assertIs(left, again_left)
+        self.assertIs(right, again_right)
+
+    def test_sessions_do_not_share_tracks(self):
+        first, = self.tracker.assign('a', [(10, 60, 60, 10)], now=0.0)
+        second, = self.tracker.assign('b', [(10, 60, 60, 10)], now=0.0)
+        self.assertIsNot(first, second)
+
+    def test_track_is_lost_after_max_track_age(self):
+        first, = self.tracker.assign('s', [(10, 60, 60, 10)], now=0.0)
+        second, = self.tracker.assign('s', [(10, 60, 60, 10)], now=2.5)
+        self.assertIsNot(first, second)
+
+    def test_confirmed_identity_is_reused_until_reverification(self):
+        track, = self.tracker.assign('s', [(10, 60, 60, 10)], now=0.0)
+        self.assertTrue(self.tracker.needs_encoding(track, now=0.0))
+
+        self.tracker.confirm(track, "Aakash", 0.3, now=0.0)
+        self.assertFalse(self.tracker.needs_encoding(track, now=1.0))
+        self.assertEqual(self.tracker.names([track]), ["Aakash"])
+
+        self.assertTrue(self.tracker.needs_encoding(track, now=5.0))
+
+    def test_unknown_or_uncertain_identity_is_encoded_again(self):
+        unknown, uncertain = self.tracker.assign('s', [(10, 60, 60, 10), (10, 260, 60, 210)], now=0.0)
+        self.tracker.confirm(unknown, "Unknown", 0.7, now=0.0)
+        self.tracker.confirm(uncertain, "Sahal", 0.55, now=0.0)
+        self.assertTrue(self.tracker.needs_encoding(unknown, now=0.1))
+        self.assertTrue(self.tracker.needs_encoding(uncertain, now=0.1))
@@ -9,4 +9,6 @@ urlpatterns = [
     path('read_text/', views.read_text, name='read_text'),
     path('activity_recognition/', views.activity_recognition, name='activity_recognition'),
     path('describe_image/', views.describe_image, name='describe_image'),  # Image description API
+    path('scheduler_status/', views.scheduler_status, name='scheduler_status'),  # Per-model thread utilization
+    path('metrics/', views.metrics, name='metrics'),  # Prometheus metrics
 ]
@@ -19,28 +19,41 @@ from tensorflow.keras.models import load_model
 import numpy as np
 import cv2
 from io import BytesIO
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import face_recognition
 from .facerec import SimpleFacerec 
+from .scheduler import get_scheduler, scheduled_endpoint, RequestAborted, DeadlineExceeded
+from .instrumentation import registry, span, timed_model_load
+from .preprocessing import preprocess_video, filter_detections
 
 
 # Logging setup
 logger = logging.getLogger(__name__)
 
+# Size the framework thread pools before any model is loaded
+scheduler = get_scheduler()
+scheduler.configure_frameworks()
+
 # Initialize face recognition system
 face_rec = SimpleFacerec()
-face_rec.load_encoding_images(os.path.join(settings.MEDIA_ROOT, 'faces'))
+with timed_model_load('face_gallery'):
+    face_rec.load_encoding_images(os.path.join(settings.MEDIA_ROOT, 'faces'))
 
 # Ensure your API key is correctly loaded from the environment
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Chat completions endpoint, OPENAI_API_BASE can point it at a local stub (see loadtest/openai_stub.py)
+OPENAI_CHAT_COMPLETIONS_URL = f"{settings.OPENAI_API_BASE.rstrip('/')}/chat/completions"
+
 # Load YOLO model
-yolo_model = torch.hub.load('ultralytics/yolov5', 'yolov5l', pretrained=True)
+with timed_model_load('yolo'):
+    yolo_model = torch.hub.load('ultralytics/yolov5', 'yolov5l', pretrained=True)
 
 # Load MoViNet-A2 Model for Activity Recognition
 activity_model_path = os.path.join(settings.MEDIA_ROOT, 'models', 'movinet_a2_kinetics_600')
-activity_model = tf.saved_model.load(activity_model_path)
+with timed_model_load('activity'):
+    activity_model = tf.saved_model.load(activity_model_path)
 
 # Load activity labels
 activity_labels_path = os.path.join(settings.MEDIA_ROOT, 'static_data', 'kinetics_600_labels.csv')
@@ -53,30 +66,39 @@ currency_model_path = os.path.join(settings.MEDIA_ROOT, 'models', 'final_mobilen
 if not os.path.exists(currency_model_path):
     raise ImproperlyConfigured(f"Currency model not found at {currency_model_path}")
     
-currency_model = load_model(currency_model_path)
+with timed_model_load('currency'):
+    currency_model = load_model(currency_model_path)
+
+# Move the pool threads the frameworks started while loading onto the configured cores
+scheduler.pin_threads()
 
 # Corrected Index to Class Mapping
 index_to_class = {0: '10', 1: '100', 2: '20', 3: '200', 4: '2000', 5: '50', 6: '500'}
 
 
 @api_view(['POST'])
+@scheduled_endpoint('detect_currency')
 def detect_currency(request):
     if 'file' in request.FILES:
         image_file = request.FILES['file']
         
         # Save the image to the uploads directory
-        file_path = default_storage.save(os.path.join('uploads', image_file.name), image_file)
+        with span('save'):
+            file_path = default_storage.save(os.path.join('uploads', image_file.name), image_file)
         full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
         
         try:
             # Load and preprocess the image for MobileNetV2
-            img = image.load_img(full_file_path, target_size=(224, 224))
-            img_array = image.img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
-            img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)  # Preprocess
+            with span('decode'):
+                img = image.load_img(full_file_path, target_size=(224, 224))
+            with span('preprocess'):
+                img_array = image.img_to_array(img)
+                img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
+                img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)  # Preprocess
 
             # Perform prediction using the loaded model
-            predictions = currency_model.predict(img_array)
+            with scheduler.run('currency', request.ticket), span('inference'):
+                predictions = currency_model.predict(img_array)
 
             # Debugging: Print the raw prediction outputs
             print(f"Raw predictions: {predictions}")
@@ -89,6 +111,8 @@ def detect_currency(request):
             print(f"Predicted class label: {predicted_class_label}")
 
             return Response({"predicted_currency": predicted_class_label})
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"Error processing file: {str(e)}")
             return Response({"error": "File processing error"}, status=500)
@@ -97,6 +121,7 @@ def detect_currency(request):
     
 # Object Detection
 @api_view(['POST'])
+@scheduled_endpoint('object_detection')
 def object_detection(request):
     logger.info("Received request for object detection")  # Logging the incoming request
     if 'file' in request.FILES:
@@ -104,7 +129,8 @@ def object_detection(request):
 
         try:
             # Save file
-            file_path = default_storage.save(os.path.join('uploads', image.name), image)
+            with span('save'):
+                file_path = default_storage.save(os.path.join('uploads', image.name), image)
             full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
             logger.info(f"Image saved at {full_file_path}")
 
@@ -115,23 +141,25 @@ def object_detection(request):
 
             # Perform object detection using YOLO
             logger.info(f"Performing object detection on {full_file_path}")
-            img = Image.open(full_file_path)
-            results = yolo_model(img)
+            with span('decode'):
+                img = Image.open(full_file_path)
+                img.load()
+            with scheduler.run('yolo', request.ticket), span('inference'):
+                results = yolo_model(img)
             logger.info(f"YOLO model results: {results}")  # Logging YOLO results
             
-            objects_detected = results.pandas().xyxy[0].to_dict(orient="records")
-
-            # Set a confidence threshold (for example, 0.5 or 50%)
-            confidence_threshold = 0.6  # Adjust this value to improve accuracy (0.5 = 50%)
-            filtered_objects = [
-                obj for obj in objects_detected if obj['confidence'] >= confidence_threshold
-            ]
+            with span('postprocess'):
+                # Set a confidence threshold (for example, 0.5 or 50%)
+                confidence_threshold = 0.6  # Adjust this value to improve accuracy (0.5 = 50%)
+                filtered_objects = filter_detections(results.pandas().xyxy[0], confidence_threshold)
 
             # Log filtered objects
             logger.info(f"Filtered objects with confidence >= {confidence_threshold}: {filtered_objects}")
 
             return Response({"detected_objects": filtered_objects})
 
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"Error processing object detection: {str(e)}")
             return Response({"error": f"Object detection error: {str(e)}"}, status=500)
@@ -141,6 +169,7 @@ def object_detection(request):
     
     
 @api_view(['POST'])
+@scheduled_endpoint('add_face')
 def add_face(request):
     """
     Endpoint to add a face. It receives images and a name, saving them for face recognition.
@@ -158,6 +187,9 @@ def add_face(request):
         logger.error("No images provided")
         return Response({"error": "No images provided"}, status=400)
 
+    # Give up now if the request is no longer wanted, nothing has been written yet
+    request.ticket.check()
+
     try:
         # Save each image for the person
         for image in images:
@@ -167,7 +199,8 @@ def add_face(request):
                 return Response({"error": f"Invalid file type {image.content_type}"}, status=400)
 
             # Save the image
-            file_path = default_storage.save(os.path.join('faces', f"{name}_{image.name}"), image)
+            with span('save'):
+                file_path = default_storage.save(os.path.join('faces', f"{name}_{image.name}"), image)
             full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
 
             # Check if the file was successfully saved
@@ -178,10 +211,15 @@ def add_face(request):
             logger.info(f"Face added for {name}, image saved at {full_file_path}")
 
         # Reload face encodings (assuming face_rec is a valid instance)
-        face_rec.load_encoding_images(os.path.join(settings.MEDIA_ROOT, 'faces'))
+        # Once the images are on disk the reload must finish, even past the deadline,
+        # otherwise the client is told the add failed while the files stay behind
+        with scheduler.run('face'), span('gallery_reload'):
+            face_rec.load_encoding_images(os.path.join(settings.MEDIA_ROOT, 'faces'))
         logger.info(f"Face added successfully for {name}")
         return Response({"message": f"Face added successfully for {name}"})
 
+    except RequestAborted:
+        raise
     except Exception as e:
         logger.error(f"Error adding face: {str(e)}")
         return Response({"error": "Add face error", "details": str(e)}, status=500)
@@ -190,6 +228,7 @@ def add_face(request):
 
 # Recognize Face from the video stream
 @api_view(['POST'])
+@scheduled_endpoint('recognize_face')
 def recognize_face(request):
     """
     Endpoint to recognize faces from an uploaded image.
@@ -200,7 +239,8 @@ def recognize_face(request):
 
         try:
             # Save the uploaded image temporarily
-            file_path = default_storage.save(os.path.join('uploads', image.name), image)
+            with span('save'):
+                file_path = default_storage.save(os.path.join('uploads', image.name), image)
             full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
 
             # Check if file is saved
@@ -209,19 +249,30 @@ def recognize_face(request):
                 return Response({"error": "Face file does not exist"}, status=500)
 
             # Load the image for face recognition
-            img = cv2.imread(full_file_path)
+            with span('decode'):
+                img = cv2.imread(full_file_path)
+
+            # Frames of the same session reuse identities of already tracked faces
+            session_id = request.META.get('HTTP_X_SESSION_ID') or request.data.get('session_id')
 
             # Detect and recognize faces in the image
-            face_locations, face_names = face_rec.detect_known_faces(img)
+            with scheduler.run('face', request.ticket):
+                if session_id:
+                    face_locations, face_names, stats = face_rec.detect_known_faces_tracked(img, session_id)
+                else:
+                    face_locations, face_names = face_rec.detect_known_faces(img)
+                    stats = {"faces": len(face_names), "encoded": len(face_names), "from_track_cache": 0}
 
             if face_names:
                 recognized_faces = [{"name": name} for name in face_names]
-                logger.info(f"Recognized faces: {recognized_faces}")
-                return Response({"recognized_faces": recognized_faces})
+                logger.info(f"Recognized faces: {recognized_faces}, stats: {stats}")
+                return Response({"recognized_faces": recognized_faces, "stats": stats})
             else:
                 logger.info("No faces recognized.")
-                return Response({"recognized_faces": []})
+                return Response({"recognized_faces": [], "stats": stats})
 
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"Error recognizing face: {str(e)}")
             return Response({"error": "Face recognition error"}, status=500)
@@ -233,6 +284,7 @@ def encode_image(image_path):
         return base64.b64encode(image_file.read()).decode('utf-8')
 
 @csrf_exempt
+@scheduled_endpoint('read_text')
 def read_text(request):
     try:
         # Check if the file is included in the request
@@ -241,10 +293,11 @@ def read_text(request):
             return JsonResponse({"error": "No file uploaded"}, status=400)
 
         # Convert the image to a base64 string
-        image = Image.open(image_file)
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        with span('decode'):
+            image = Image.open(image_file)
+            buffered = BytesIO()
+            image.save(buffered, format="JPEG")
+            base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
         # Create the headers for the request to OpenAI
         headers = {
@@ -275,8 +328,14 @@ def read_text(request):
             "max_tokens": 300
         }
 
-        # Make the request to OpenAI API
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        # Make the request to OpenAI API, giving up once the client's deadline passes
+        request.ticket.check()
+        try:
+            with span('openai'):
+                response = requests.post(OPENAI_CHAT_COMPLETIONS_URL, headers=headers, json=payload,
+                                         timeout=request.ticket.timeout())
+        except requests.Timeout:
+            raise DeadlineExceeded("OpenAI request outlived the deadline")
 
         # Parse the response from OpenAI
         result = response.json()
@@ -292,56 +351,41 @@ def read_text(request):
         else:
             return JsonResponse({"error": f"OpenAI Error: {result['error']['message']}"}, status=response.status_code)
 
+    except RequestAborted:
+        raise
     except Exception as e:
         # Print the error in the terminal
         print(f"Internal Server Error: {str(e)}")
         return JsonResponse({"error": f"Internal Server Error: {str(e)}"}, status=500)
     
     
-# Preprocess video for MoViNet model
-def preprocess_video(video_path, frame_size=(224, 224), num_frames=100):
-    frames = []
-    cap = cv2.VideoCapture(video_path)
-    frame_count = 0
-
-    while cap.isOpened() and frame_count < num_frames:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        resized_frame = cv2.resize(frame, frame_size)
-        rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
-        normalized_frame = rgb_frame / 255.0
-        frames.append(normalized_frame)
-        frame_count += 1
-
-    cap.release()
-
-    # Convert list of frames to a NumPy array
-    video_tensor = np.stack(frames, axis=0)
-    video_tensor = np.expand_dims(video_tensor, axis=0)  # Add batch dimension
-    return tf.convert_to_tensor(video_tensor, dtype=tf.float32)
-
 # Activity recognition endpoint
 @api_view(['POST'])
+@scheduled_endpoint('activity_recognition')
 def activity_recognition(request):
     if 'file' in request.FILES:
         video = request.FILES['file']
         try:
             # Save video temporarily
-            file_path = default_storage.save(os.path.join('uploads', video.name), video)
+            with span('save'):
+                file_path = default_storage.save(os.path.join('uploads', video.name), video)
             full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
 
             # Preprocess video for model input
-            video_tensor = preprocess_video(full_file_path)
+            with span('preprocess'):
+                video_tensor = preprocess_video(full_file_path, ticket=request.ticket)
 
             # Run the video through the model
-            logits = activity_model.signatures["serving_default"](video_tensor)
-            predictions = tf.nn.softmax(logits['classifier_head'], axis=-1).numpy()[0]
+            with scheduler.run('activity', request.ticket), span('inference'):
+                logits = activity_model.signatures["serving_default"](video_tensor)
+
+            with span('postprocess'):
+                predictions = tf.nn.softmax(logits['classifier_head'], axis=-1).numpy()[0]
 
-            # Get the top prediction
-            top_prediction_idx = np.argmax(predictions)
-            confidence = predictions[top_prediction_idx]
-            predicted_activity = activity_names[top_prediction_idx]
+                # Get the top prediction
+                top_prediction_idx = np.argmax(predictions)
+                confidence = predictions[top_prediction_idx]
+                predicted_activity = activity_names[top_prediction_idx]
 
             # Log prediction for debugging
             logger.info(f"Predicted Activity: {predicted_activity}, Confidence: {confidence:.2f}")
@@ -353,6 +397,8 @@ def activity_recognition(request):
                 "confidence": float(confidence)
             })
 
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"Error processing activity recognition: {str(e)}")
             return Response({"error": "Activity recognition error"}, status=500)
@@ -362,10 +408,11 @@ def activity_recognition(request):
     
     
 # Function to describe the image using OpenAI API
-def generate_image_description(image_path):
+def generate_image_description(image_path, ticket=None):
     try:
         # Encode the image as base64
-        base64_image = encode_image(image_path)
+        with span('decode'):
+            base64_image = encode_image(image_path)
 
         # Set up the headers and payload for the API request
         headers = {
@@ -395,29 +442,40 @@ def generate_image_description(image_path):
             "max_tokens": 300
         }
 
-        # Send the request to the OpenAI API
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        # Send the request to the OpenAI API, giving up once the client's deadline passes
+        if ticket is not None:
+            ticket.check()
+        try:
+            with span('openai'):
+                response = requests.post(OPENAI_CHAT_COMPLETIONS_URL, headers=headers, json=payload,
+                                         timeout=ticket.timeout() if ticket else None)
+        except requests.Timeout:
+            raise DeadlineExceeded("OpenAI request outlived the deadline")
         response.raise_for_status()  # Raise an error for bad responses (status code 4xx or 5xx)
 
         # Get the description from the API response
         return response.json()['choices'][0]['message']['content'].strip()
 
+    except RequestAborted:
+        raise
     except Exception as e:
         logger.error(f"Error processing image description: {str(e)}")
         return None
 
 # Django view to handle image upload and description generation
 @api_view(['POST'])
+@scheduled_endpoint('describe_image')
 def describe_image(request):
     try:
         # Check if the file is present in the request
         if 'file' in request.FILES:
             image = request.FILES['file']
-            file_path = default_storage.save(os.path.join('uploads', image.name), image)
+            with span('save'):
+                file_path = default_storage.save(os.path.join('uploads', image.name), image)
             full_file_path = os.path.join(settings.MEDIA_ROOT, file_path)
 
             # Generate the description for the uploaded image
-            description = generate_image_description(full_file_path)
+            description = generate_image_description(full_file_path, ticket=request.ticket)
 
             if description:
                 return Response({"description": description})
@@ -425,6 +483,19 @@ def describe_image(request):
                 return Response({"error": "Could not generate description"}, status=500)
         else:
             return Response({"error": "No file provided"}, status=400)
+    except RequestAborted:
+        raise
     except Exception as e:
         logger.error(f"Error in describe_image: {str(e)}")
-        return Response({"error": "Error processing image"}, status=500)
\ No newline at end of file
+        return Response({"error": "Error processing image"}, status=500)
+
+
+# Per-model thread budget utilization
+@api_view(['GET'])
+def scheduler_status(request):
+    return Response(scheduler.stats())
+
+
+# Prometheus scrape endpoint
+def metrics(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
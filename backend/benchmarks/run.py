@@ -0,0 +1,251 @@
+"""
+Offline micro-benchmarks for the inference hot paths.
+
+Every case runs on synthetic inputs at several scales, without network or GPU,
+and reports latency (p50/p95/mean), throughput and peak Python memory (not for
+the torch/TensorFlow inference cases, whose memory tracemalloc cannot see). Results
+can be saved as a baseline; later runs compared against it fail when a case got
+slower or hungrier than the tolerance allows. A baseline recorded on another
+machine (architecture, CPU count or Python version) is not compared against:
+the run exits with status 2 unless --ignore-machine is given.
+
+Usage (from the backend directory):
+    python -m benchmarks.run                          # run everything, compare with the baseline if present
+    python -m benchmarks.run --save-baseline          # record a new baseline
+    python -m benchmarks.run --cases face_match --scales small medium
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from .synthetic import SCALES, make_image, face_boxes, make_video, make_gallery, make_detections
+from . import standins
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+ACTIVITY_MODEL_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'media', 'models', 'movinet_a2_kinetics_600')
+
+# Registered cases: name -> setup(scale) returning (callable, items processed per call)
+CASES = {}
+# Cases whose memory lives in torch/TensorFlow/dlib native allocators, which tracemalloc cannot see
+NATIVE_MEMORY_CASES = set()
+
+
+def case(name, native_memory=False):
+    def register(setup):
+        CASES[name] = setup
+        if native_memory:
+            NATIVE_MEMORY_CASES.add(name)
+        return setup
+    return register
+
+
+def _facerec_with_faces(scale):
+    facerec = standins.import_facerec()
+    height, width = scale['image']
+    face_rec = facerec.SimpleFacerec()
+    face_rec.known_face_encodings, face_rec.known_face_names = make_gallery(scale['gallery'])
+
+    # Faces are located on the downscaled frame, so the boxes are too
+    small = (int(height * face_rec.frame_resizing), int(width * face_rec.frame_resizing))
+    facerec.face_recognition = standins.StandInFaceRecognition(face_boxes(*small, scale['faces']))
+    return face_rec, make_image(height, width)
+
+
+@case('face_match')
+def face_match(scale):
+    face_rec, _ = _facerec_with_faces(scale)
+    probes, _ = make_gallery(scale['faces'] * 5, seed=1)
+    probes = probes[:scale['faces']]
+
+    def run():
+        for probe in probes:
+            face_rec.match_encoding(probe)
+    return run, len(probes)
+
+
+@case('face_detect_known')
+def face_detect_known(scale):
+    face_rec, frame = _facerec_with_faces(scale)
+    return lambda: face_rec.detect_known_faces(frame), scale['faces']
+
+
+@case('face_detect_tracked')
+def face_detect_tracked(scale):
+    # Steady state of a session scanning a room: every face continues a confirmed track
+    face_rec, frame = _facerec_with_faces(scale)
+    face_rec.tracker.confident_distance = float('inf')
+    face_rec.tracker.reverify_interval = float('inf')
+    face_rec.tracker.max_track_age = float('inf')
+    face_rec.detect_known_faces_tracked(frame, 'bench')
+    return lambda: face_rec.detect_known_faces_tracked(frame, 'bench'), scale['faces']
+
+
+@case('preprocess_video')
+def preprocess_video(scale):
+    from api.preprocessing import preprocess_video as preprocess
+    path = os.path.join(tempfile.mkdtemp(prefix='vision-bench-'), 'clip.mp4')
+    make_video(path, scale['video_frames'])
+    return lambda: preprocess(path), scale['video_frames']
+
+
+@case('yolo_postprocess')
+def yolo_postprocess(scale):
+    from api.preprocessing import filter_detections
+    detections = make_detections(scale['detections'])
+    return lambda: filter_detections(detections, 0.6), scale['detections']
+
+
+@case('yolo_inference', native_memory=True)
+def yolo_inference(scale):
+    import torch
+    model = standins.tiny_detector()
+    height, width = scale['image']
+    tensor = torch.from_numpy(make_image(height, width)).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+
+    def run():
+        with torch.no_grad():
+            model(tensor)
+    return run, 1
+
+
+@case('activity_inference', native_memory=True)
+def activity_inference(scale):
+    import numpy as np
+    import tensorflow as tf
+    model, _ = standins.activity_model(ACTIVITY_MODEL_DIR)
+    frames = min(scale['video_frames'], 32)
+    video = tf.convert_to_tensor(np.random.default_rng(0).random((1, frames, 224, 224, 3)), dtype=tf.float32)
+    return lambda: tf.nn.softmax(model(video), axis=-1).numpy(), 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def measure(run, items, repeat, warmup, track_memory=True):
+    for _ in range(warmup):
+        run()
+
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started_at)
+
+    # Separate pass, tracemalloc slows the code it watches.
+    # Only Python-visible allocations (including numpy buffers) are counted.
+    peak = None
+    if track_memory:
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    mean = sum(timings) / len(timings)
+    return {
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'mean_ms': mean * 1000,
+        'throughput_per_s': items / mean if mean > 0 else 0.0,
+        'peak_memory_kb': peak / 1024 if peak is not None else None,
+        'repeat': repeat,
+    }
+
+
+def machine_info():
+    # Only what changes timings: not the kernel release or the Python patch level
+    return {'python': '.'.join(platform.python_version_tuple()[:2]), 'arch': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: Descriptions of every case that regressed beyond the tolerance.
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'peak_memory_kb'):
+            # No memory figure for native-memory cases, nothing to compare
+            if result[metric] is None or not previous.get(metric):
+                continue
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {previous[metric]:.2f} -> {result[metric]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=list(SCALES))
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per case')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed runs per case')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare with or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before failing (0.2 = 20%%)')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--ignore-machine', action='store_true',
+                        help='Compare even if the baseline was recorded on another machine or Python version')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':<22} {'scale':<7} {'p50 ms':>9} {'p95 ms':>9} {'items/s':>10} {'peak KB':>10}")
+    for name in args.cases:
+        for scale_name in args.scales:
+            key = f"{name}/{scale_name}"
+            try:
+                run, items = CASES[name](SCALES[scale_name])
+            except ImportError as e:
+                print(f"{name:<22} {scale_name:<7} skipped ({str(e)})")
+                continue
+            result = measure(run, items, args.repeat, args.warmup, track_memory=name not in NATIVE_MEMORY_CASES)
+            results[key] = result
+            peak = f"{result['peak_memory_kb']:>10.1f}" if result['peak_memory_kb'] is not None else f"{'n/a':>10}"
+            print(f"{name:<22} {scale_name:<7} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                  f"{result['throughput_per_s']:>10.1f} {peak}")
+
+    report = {
+        'machine': machine_info(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        # Timings from another machine or Python version say nothing about this change
+        if baseline.get('machine') != report['machine']:
+            print(f"Baseline machine {baseline.get('machine')} differs from this one {report['machine']}.")
+            if not args.ignore_machine:
+                print("Record a new baseline here with --save-baseline, or compare anyway with --ignore-machine.")
+                return 2
+
+        regressions = compare(results, baseline.get('results', {}), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Small stand-ins for the models whose weights are not available offline.
+
+The stand-ins keep the input and output shapes of the real models, so the code
+around them (preprocessing, matching, post-processing) runs exactly as in the views.
+"""
+import os
+import sys
+import types
+
+import numpy as np
+
+try:
+    import face_recognition as real_face_recognition
+except ImportError:
+    real_face_recognition = None
+
+
+def face_distance(face_encodings, face_to_compare):
+    # Same computation as face_recognition.face_distance
+    if len(face_encodings) == 0:
+        return np.empty((0,))
+    return np.linalg.norm(np.asarray(face_encodings) - face_to_compare, axis=1)
+
+
+def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
+    return list(face_distance(known_face_encodings, face_encoding_to_check) <= tolerance)
+
+
+class StandInFaceRecognition(types.ModuleType):
+    """
+    Drop-in for the face_recognition module. Synthetic frames contain no real faces,
+    so detection returns preset boxes; encoding uses dlib when it is installed and a
+    fixed random projection of the face crop otherwise.
+    """
+
+    def __init__(self, boxes=None, seed=0):
+        super().__init__('face_recognition')
+        self.boxes = boxes or []
+        self._projection = np.random.default_rng(seed).normal(0, 0.02, size=(16 * 16 * 3, 128))
+
+    def face_locations(self, img):
+        height, width = img.shape[:2]
+        return [box for box in self.boxes if box[2] <= height and box[1] <= width]
+
+    def face_encodings(self, img, known_face_locations=None):
+        locations = self.face_locations(img) if known_face_locations is None else known_face_locations
+        if real_face_recognition is not None:
+            return real_face_recognition.face_encodings(img, locations)
+        encodings = []
+        for top, right, bottom, left in locations:
+            crop = img[top:bottom, left:right]
+            step_y, step_x = max(crop.shape[0] // 16, 1), max(crop.shape[1] // 16, 1)
+            thumbnail = crop[::step_y, ::step_x][:16, :16].astype(np.float64) / 255.0
+            thumbnail = np.pad(thumbnail, ((0, 16 - thumbnail.shape[0]), (0, 16 - thumbnail.shape[1]), (0, 0)))
+            encodings.append(thumbnail.reshape(-1) @ self._projection)
+        return encodings
+
+    face_distance = staticmethod(face_distance)
+    compare_faces = staticmethod(compare_faces)
+
+
+def import_facerec():
+    """
+    Import api.facerec, registering a stand-in face_recognition module if dlib is not installed.
+    """
+    if real_face_recognition is None and 'face_recognition' not in sys.modules:
+        sys.modules['face_recognition'] = StandInFaceRecognition()
+    from api import facerec
+    return facerec
+
+
+def tiny_detector():
+    """
+    Small convolutional network standing in for YOLOv5 on CPU.
+    """
+    import torch
+    from torch import nn
+
+    model = nn.Sequential(
+        nn.Conv2d(3, 16, 3, stride=2, padding=1), nn.SiLU(),
+        nn.Conv2d(16, 32, 3, stride=2, padding=1), nn.SiLU(),
+        nn.Conv2d(32, 64, 3, stride=2, padding=1), nn.SiLU(),
+        nn.Conv2d(64, 85, 1),
+    )
+    model.eval()
+    torch.manual_seed(0)
+    return model
+
+
+def activity_model(model_dir):
+    """
+    The MoViNet-A2 saved model when its weights are present, otherwise a small
+    Conv3D network with the same input layout and 600 output classes.
+    """
+    import tensorflow as tf
+
+    if os.path.exists(os.path.join(model_dir, 'saved_model.pb')):
+        model = tf.saved_model.load(model_dir)
+        signature = model.signatures["serving_default"]
+        return lambda video: signature(video)['classifier_head'], 'movinet_a2'
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(None, 224, 224, 3)),
+        tf.keras.layers.Conv3D(8, (1, 7, 7), strides=(1, 4, 4), activation='relu'),
+        tf.keras.layers.Conv3D(16, (3, 3, 3), strides=(2, 2, 2), activation='relu'),
+        tf.keras.layers.GlobalAveragePooling3D(),
+        tf.keras.layers.Dense(600),
+    ])
+    return lambda video: model(video, training=False), 'standin'
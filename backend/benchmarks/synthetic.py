@@ -0,0 +1,86 @@
+"""
+Synthetic inputs for the benchmarks: images, videos, face galleries and YOLO detections.
+Everything is generated from a seed, so runs are comparable across machines and commits.
+"""
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+
+# Input sizes exercised by the benchmarks
+SCALES = {
+    'small': {'image': (480, 640), 'video_frames': 16, 'gallery': 25, 'faces': 1, 'detections': 20},
+    'medium': {'image': (720, 1280), 'video_frames': 50, 'gallery': 250, 'faces': 3, 'detections': 100},
+    'large': {'image': (1080, 1920), 'video_frames': 100, 'gallery': 2500, 'faces': 8, 'detections': 500},
+}
+
+
+def make_image(height, width, seed=0):
+    """
+    BGR image with smooth gradients and noise, closer to a camera frame than pure noise.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.normal(0, 12, size=(height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def face_boxes(height, width, count):
+    """
+    Evenly spread (top, right, bottom, left) face boxes for an image of the given size.
+    """
+    size = max(min(height, width) // 5, 8)
+    boxes = []
+    for i in range(count):
+        left = int((i + 0.5) * width / count - size / 2)
+        top = height // 3
+        boxes.append((top, left + size, top + size, left))
+    return boxes
+
+
+def make_video(path, frames, frame_size=(360, 640), fps=25, seed=0):
+    """
+    Write a short moving-gradient video to path and return the path.
+    """
+    height, width = frame_size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    base = make_image(height, width, seed)
+    for i in range(frames):
+        writer.write(np.roll(base, shift=i * 4, axis=1))
+    writer.release()
+    if not os.path.exists(path):
+        raise RuntimeError(f"OpenCV could not write the synthetic video at {path}")
+    return path
+
+
+def make_gallery(size, seed=0):
+    """
+    Known face encodings and names, five 128-d encodings per person like the faces/ directory.
+    """
+    rng = np.random.default_rng(seed)
+    people = max(size // 5, 1)
+    centers = rng.normal(0, 0.1, size=(people, 128))
+    encodings = [centers[i % people] + rng.normal(0, 0.02, size=128) for i in range(size)]
+    names = [f"person{i % people}" for i in range(size)]
+    return encodings, names
+
+
+def make_detections(count, seed=0):
+    """
+    DataFrame shaped like YOLOv5's results.pandas().xyxy[0].
+    """
+    rng = np.random.default_rng(seed)
+    xmin = rng.uniform(0, 600, count)
+    ymin = rng.uniform(0, 400, count)
+    classes = rng.integers(0, 80, count)
+    return pd.DataFrame({
+        'xmin': xmin,
+        'ymin': ymin,
+        'xmax': xmin + rng.uniform(10, 200, count),
+        'ymax': ymin + rng.uniform(10, 200, count),
+        'confidence': rng.uniform(0.25, 1.0, count),
+        'class': classes,
+        'name': [f"class{c}" for c in classes],
+    })
@@ -0,0 +1,253 @@
+"""
+End-to-end load generator for the /api/ endpoints of a running server.
+
+Replays a weighted mix of multipart uploads either at a fixed request rate
+(open loop, --rate) or with a fixed number of concurrent clients (closed loop,
+--concurrency), then reports p50/p95/p99 latency, error rate and throughput
+per endpoint.
+
+Run the server against the local OpenAI stub so read_text and describe_image
+do not hit the real API, e.g.:
+    python -m loadtest.openai_stub --port 8090 --latency-ms 800 &
+    OPENAI_API_BASE=http://127.0.0.1:8090/v1 python manage.py runserver
+
+Usage (from the backend directory):
+    python -m loadtest.harness --concurrency 8 --duration 60
+    python -m loadtest.harness --rate 5 --duration 60 --mix detect_currency=3 recognize_face=3 describe_image=1
+
+add_face is left out of the default mix: every call writes images into
+media/faces and reloads the whole gallery on the server.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import requests
+
+from benchmarks.synthetic import make_image, make_video
+from .scheduler_mix import percentile
+
+# Default share of each endpoint in the traffic
+DEFAULT_MIX = {
+    'detect_currency': 3,
+    'object_detection': 2,
+    'recognize_face': 3,
+    'add_face': 0,
+    'read_text': 1,
+    'activity_recognition': 1,
+    'describe_image': 1,
+}
+
+
+class Payloads:
+    """
+    Synthetic uploads, generated once and reused by every request.
+    """
+
+    def __init__(self, image_size=(720, 1280), video_frames=50):
+        ok, encoded = cv2.imencode('.jpg', make_image(*image_size))
+        if not ok:
+            raise RuntimeError("Could not encode the synthetic image")
+        self.image = encoded.tobytes()
+
+        path = os.path.join(tempfile.mkdtemp(prefix='vision-load-'), 'clip.mp4')
+        with open(make_video(path, video_frames), 'rb') as f:
+            self.video = f.read()
+
+    def build(self, endpoint, sequence):
+        """
+        :return: (files, data) arguments for requests.post.
+        """
+        name = f"loadtest_{sequence}"
+        if endpoint == 'activity_recognition':
+            return {'file': (f"{name}.mp4", self.video, 'video/mp4')}, {}
+        if endpoint == 'add_face':
+            return [('files', (f"{name}.jpg", self.image, 'image/jpeg'))], {'name': 'loadtest'}
+        return {'file': (f"{name}.jpg", self.image, 'image/jpeg')}, {}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def add(self, endpoint, latency, status):
+        with self.lock:
+            self.results.setdefault(endpoint, []).append((latency, status))
+
+    def summary(self, wall_seconds):
+        report = {}
+        everything = []
+        with self.lock:
+            for endpoint, samples in sorted(self.results.items()):
+                everything.extend(samples)
+                report[endpoint] = summarize(samples, wall_seconds)
+        report['ALL'] = summarize(everything, wall_seconds)
+        return report
+
+
+def summarize(samples, wall_seconds):
+    # Requests that were never sent count as errors but have no latency
+    latencies = [latency for latency, _ in samples if latency is not None]
+    errors = [status for _, status in samples if not (isinstance(status, int) and 200 <= status < 300)]
+    by_status = {}
+    for _, status in samples:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_rate': len(errors) / len(samples) if samples else 0.0,
+        'throughput_rps': (len(samples) - len(errors)) / wall_seconds if wall_seconds else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statuses': by_status,
+    }
+
+
+def parse_mix(entries):
+    mix = dict(DEFAULT_MIX)
+    if entries:
+        mix = {endpoint: 0 for endpoint in DEFAULT_MIX}
+        for entry in entries:
+            endpoint, _, weight = entry.partition('=')
+            if endpoint not in mix:
+                raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint}")
+            mix[endpoint] = float(weight or 1)
+    mix = {endpoint: weight for endpoint, weight in mix.items() if weight > 0}
+    if not mix:
+        raise argparse.ArgumentTypeError("The mix has no endpoint with a positive weight")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000/api')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--concurrency', type=int, help='Closed loop: number of concurrent clients (default 4)')
+    target.add_argument('--rate', type=float, help='Open loop: requests started per second')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Open loop: cap on outstanding requests')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to generate load for')
+    parser.add_argument('--mix', nargs='+', metavar='ENDPOINT=WEIGHT', help='Traffic mix, e.g. detect_currency=3')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds')
+    parser.add_argument('--deadline-ms', type=float, help='Send this X-Request-Deadline-Ms with every request')
+    parser.add_argument('--sessions', type=int, default=0,
+                        help='Spread recognize_face over this many X-Session-Id values (0 = no sessions)')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[720, 1280], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--video-frames', type=int, default=50)
+    parser.add_argument('--start-stub', type=int, metavar='PORT',
+                        help='Also run the OpenAI stub on this port (the server must use it via OPENAI_API_BASE)')
+    parser.add_argument('--stub-latency-ms', type=float, default=800.0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    endpoints, weights = list(mix), list(mix.values())
+    payloads = Payloads(tuple(args.image_size), args.video_frames)
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+    sequence = iter(range(sys.maxsize))
+
+    stub = None
+    if args.start_stub:
+        from .openai_stub import StubConfig, start_stub
+        stub = start_stub(port=args.start_stub, config=StubConfig(
+            latency_ms=args.stub_latency_ms, error_rate=args.stub_error_rate, seed=args.seed))
+        print(f"OpenAI stub listening on port {args.start_stub}")
+
+    local = threading.local()
+
+    def pick():
+        with rng_lock:
+            endpoint = rng.choices(endpoints, weights)[0]
+            number = next(sequence)
+            session_index = rng.randrange(args.sessions) if args.sessions else None
+        return endpoint, number, session_index
+
+    def fire(endpoint, number, session_index):
+        # One HTTP session per worker thread keeps connections alive
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+
+        files, data = payloads.build(endpoint, number)
+        headers = {}
+        if args.deadline_ms:
+            headers['X-Request-Deadline-Ms'] = str(args.deadline_ms)
+        if endpoint == 'recognize_face' and session_index is not None:
+            headers['X-Session-Id'] = f"loadtest-{session_index}"
+
+        started_at = time.perf_counter()
+        try:
+            response = local.session.post(f"{args.base_url.rstrip('/')}/{endpoint}/", files=files, data=data,
+                                          headers=headers, timeout=args.timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        recorder.add(endpoint, time.perf_counter() - started_at, status)
+
+    started_at = time.perf_counter()
+    stop_at = started_at + args.duration
+    if args.rate:
+        # Open loop: start requests on schedule whether or not earlier ones finished
+        in_flight = threading.BoundedSemaphore(args.max_in_flight)
+        dropped = 0
+
+        def fire_and_release(*request):
+            try:
+                fire(*request)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+            next_start = started_at
+            while next_start < stop_at:
+                time.sleep(max(next_start - time.perf_counter(), 0))
+                request = pick()
+                if in_flight.acquire(blocking=False):
+                    pool.submit(fire_and_release, *request)
+                else:
+                    # Count the skipped send against its endpoint, hiding it would flatter the overload point
+                    recorder.add(request[0], None, 'not_sent')
+                    dropped += 1
+                next_start += 1.0 / args.rate
+        if dropped:
+            print(f"{dropped} requests not sent (reported as errors), {args.max_in_flight} were already in flight")
+    else:
+        # Closed loop: every client sends its next request once the previous one returns
+        def client():
+            while time.perf_counter() < stop_at:
+                fire(*pick())
+
+        clients = [threading.Thread(target=client) for _ in range(args.concurrency or 4)]
+        for worker in clients:
+            worker.start()
+        for worker in clients:
+            worker.join()
+    wall = time.perf_counter() - started_at
+
+    if stub is not None:
+        stub.shutdown()
+
+    report = recorder.summary(wall)
+    print(f"{'endpoint':<22} {'reqs':>6} {'err %':>7} {'ok/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in report.items():
+        print(f"{endpoint:<22} {stats['requests']:>6} {stats['error_rate'] * 100:>7.1f} {stats['throughput_rps']:>7.2f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'wall_seconds': wall, 'mix': mix, 'endpoints': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
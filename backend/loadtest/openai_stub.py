@@ -0,0 +1,143 @@
+"""
+Local stand-in for the OpenAI chat-completions endpoint, for load tests.
+
+Answers POST /v1/chat/completions after a configurable latency and fails a
+configurable fraction of requests with OpenAI-style error bodies. Start the
+Django server with OPENAI_API_BASE=http://127.0.0.1:<port>/v1 to use it.
+
+Usage (from the backend directory):
+    python -m loadtest.openai_stub --port 8090 --latency-ms 800 --jitter-ms 200 --error-rate 0.02
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, error_rate=0.0, rate_limit_rate=0.0,
+                 reply="Stub reply from the local OpenAI stand-in.", seed=None):
+        """
+        :param latency_ms: Mean time before answering.
+        :param jitter_ms: Standard deviation of the latency.
+        :param error_rate: Fraction of requests answered with a 500 server error.
+        :param rate_limit_rate: Fraction of requests answered with a 429 rate-limit error.
+        :param reply: Content of the assistant message.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'ok': 0, 'server_error': 0, 'rate_limited': 0}
+
+    def draw(self):
+        # Random draws are shared between handler threads
+        with self.lock:
+            latency = max(self.random.gauss(self.latency_ms, self.jitter_ms), 0.0) / 1000.0
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return latency, 'server_error'
+        if roll < self.error_rate + self.rate_limit_rate:
+            return latency, 'rate_limited'
+        return latency, 'ok'
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+
+def make_handler(config):
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            if self.path.rstrip('/') != '/v1/chat/completions':
+                self._reply(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                return
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                self._reply(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+                return
+
+            latency, outcome = config.draw()
+            time.sleep(latency)
+            config.count(outcome)
+
+            if outcome == 'server_error':
+                self._reply(500, {"error": {"message": "The server had an error (stub)", "type": "server_error"}})
+            elif outcome == 'rate_limited':
+                self._reply(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}})
+            else:
+                self._reply(200, {
+                    "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get('model', 'stub'),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": config.reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # Keep the console quiet under load
+            pass
+
+    return ChatCompletionsHandler
+
+
+def start_stub(host='127.0.0.1', port=8090, config=None):
+    """
+    Start the stub on a background thread.
+    :return: The running server, stop it with server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=800.0)
+    parser.add_argument('--jitter-ms', type=float, default=200.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 500 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of 429 responses')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Responses: {config.counts}")
+
+
+if __name__ == '__main__':
+    main()
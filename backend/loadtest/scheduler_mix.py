@@ -0,0 +1,160 @@
+"""
+Mixed-traffic load test for the CPU thread-budget scheduler (api/scheduler.py).
+
+Runs the same mix of TensorFlow, PyTorch and BLAS (dlib stand-in) inferences twice,
+each in a fresh process: once with every framework sizing its pools to all cores,
+and once with the pools sized and admissions gated by ModelScheduler. Prints
+p50/p99 latency per model for both runs.
+
+Usage (from the backend directory):
+    python -m loadtest.scheduler_mix --clients 8 --requests 200
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import threading
+from contextlib import nullcontext
+
+# Relative cost of one synthetic inference of each model and its share of the traffic
+WORKLOAD = {
+    'currency': {'size': 384, 'repeat': 2, 'weight': 4},
+    'yolo': {'size': 512, 'repeat': 2, 'weight': 3},
+    'face': {'size': 256, 'repeat': 4, 'weight': 4},
+    'activity': {'size': 768, 'repeat': 2, 'weight': 1},
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_mix(mode, clients, requests_total, seed):
+    # Environment for BLAS pools must be fixed before numpy is imported
+    if mode == 'scheduled':
+        from api.scheduler import ModelScheduler, DEFAULT_MODEL_BUDGETS
+        os.environ['OMP_NUM_THREADS'] = str(DEFAULT_MODEL_BUDGETS['face']['intra_op_threads'])
+        os.environ['OPENBLAS_NUM_THREADS'] = os.environ['OMP_NUM_THREADS']
+        os.environ['MKL_NUM_THREADS'] = os.environ['OMP_NUM_THREADS']
+        scheduler = ModelScheduler(DEFAULT_MODEL_BUDGETS)
+        scheduler.configure_frameworks()
+    else:
+        scheduler = None
+
+    import numpy as np
+    import torch
+    import tensorflow as tf
+
+    inputs = {
+        name: np.random.rand(spec['size'], spec['size']).astype(np.float32)
+        for name, spec in WORKLOAD.items()
+    }
+
+    def infer(model):
+        spec = WORKLOAD[model]
+        data = inputs[model]
+        for _ in range(spec['repeat']):
+            if model in ('currency', 'activity'):
+                tf.linalg.matmul(data, data).numpy()
+            elif model == 'yolo':
+                tensor = torch.from_numpy(data)
+                torch.matmul(tensor, tensor)
+            else:
+                data @ data
+
+    rng = random.Random(seed)
+    names = list(WORKLOAD)
+    weights = [WORKLOAD[name]['weight'] for name in names]
+    plan = [rng.choices(names, weights)[0] for _ in range(requests_total)]
+
+    # Warm up every framework once so pool creation is not measured
+    for name in names:
+        infer(name)
+
+    latencies = {name: [] for name in names}
+    lock = threading.Lock()
+    cursor = iter(plan)
+
+    def client():
+        while True:
+            with lock:
+                model = next(cursor, None)
+            if model is None:
+                return
+            started_at = time.perf_counter()
+            with scheduler.run(model) if scheduler else nullcontext():
+                infer(model)
+            elapsed = time.perf_counter() - started_at
+            with lock:
+                latencies[model].append(elapsed)
+
+    started_at = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started_at
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        'mode': mode,
+        'wall_seconds': wall,
+        'throughput_rps': len(everything) / wall,
+        'p50_ms': percentile(everything, 50) * 1000,
+        'p99_ms': percentile(everything, 99) * 1000,
+        'models': {
+            name: {
+                'count': len(values),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+            for name, values in latencies.items()
+        },
+        'scheduler': scheduler.stats() if scheduler else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=200, help='Total inferences per run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['unmanaged', 'scheduled'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run a single mode and report as JSON
+    if args.mode:
+        print(json.dumps(run_mix(args.mode, args.clients, args.requests, args.seed)))
+        return
+
+    results = []
+    for mode in ('unmanaged', 'scheduled'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'loadtest.scheduler_mix', '--mode', mode,
+             '--clients', str(args.clients), '--requests', str(args.requests), '--seed', str(args.seed)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10} {'model':<9} {'count':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        for name, stats in result['models'].items():
+            print(f"{result['mode']:<10} {name:<9} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+        print(f"{result['mode']:<10} {'ALL':<9} {sum(m['count'] for m in result['models'].values()):>6} "
+              f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}  ({result['throughput_rps']:.1f} req/s)")
+
+    unmanaged, scheduled = results
+    if scheduled['p99_ms']:
+        print(f"p99 improvement: {unmanaged['p99_ms'] / scheduled['p99_ms']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
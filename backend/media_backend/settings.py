@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.instrumentation.InstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'media_backend.urls'
@@ -143,4 +144,42 @@ CORS_ALLOW_ALL_ORIGINS = True
 from dotenv import load_dotenv
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+# Overrides of the per-model CPU thread budgets in api/scheduler.py (DEFAULT_MODEL_BUDGETS),
+# e.g. {'activity': {'intra_op_threads': 2}}. intra_op/inter_op size each framework's thread pools.
+MODEL_THREAD_BUDGETS = {}
+
+# Optional CPU cores the whole process (including the framework pools) is pinned to, e.g. "0-3" or "0,2,4"
+INFERENCE_CORES = None
+if os.getenv('INFERENCE_CORES'):
+    INFERENCE_CORES = set()
+    for part in os.getenv('INFERENCE_CORES').split(','):
+        first, _, last = part.partition('-')
+        INFERENCE_CORES.update(range(int(first), int(last or first) + 1))
+
+# Total threads concurrent inferences may use together. Defaults to the number of usable cores:
+# INFERENCE_CORES when set, otherwise the process affinity mask (which respects container cpusets)
+INFERENCE_THREAD_BUDGET = int(os.getenv('INFERENCE_THREAD_BUDGET', '0')) or None
+
+# BLAS/OpenMP pools (used by dlib and numpy) are sized on first import, so export them early
+from api.scheduler import model_budgets
+_blas_threads = str(model_budgets(MODEL_THREAD_BUDGETS)['face']['intra_op_threads'])
+os.environ.setdefault('OMP_NUM_THREADS', _blas_threads)
+os.environ.setdefault('OPENBLAS_NUM_THREADS', _blas_threads)
+os.environ.setdefault('MKL_NUM_THREADS', _blas_threads)
+
+# Overrides of the priority classes (lower is admitted first) and of the class of each endpoint,
+# merged over DEFAULT_PRIORITY_CLASSES / DEFAULT_ENDPOINT_PRIORITIES in api/scheduler.py.
+# Clients may also send X-Request-Deadline-Ms, work still queued past it is dropped with a 504.
+# Work of clients that disconnect is dropped with a 499, but only under gunicorn: it is the only
+# server exposing the client socket, under `manage.py runserver` disconnects are never noticed.
+REQUEST_PRIORITY_CLASSES = {}
+ENDPOINT_PRIORITIES = {}
+
+# Sampled cProfile capture: profile this fraction of requests and keep the dump
+# (under PROFILE_DIR) only when the request took longer than PROFILE_SLOW_REQUEST_SECONDS
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_REQUEST_SECONDS = float(os.getenv('PROFILE_SLOW_REQUEST_SECONDS', '2.0'))
+PROFILE_DIR = os.path.join(MEDIA_ROOT, 'profiles')